@@ -1,40 +1,84 @@
+import io
+
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from datetime import datetime
+import plotly.graph_objects as go
 import matplotlib.pyplot as plt
 import numpy as np
 
 # 設定應用標題
 st.title("處理生物出現資料：檢查格式及視覺化")
 
-# 格式化學名的函數
-def standardize_species(scientific_name):
-    if pd.notna(scientific_name):
-        return scientific_name.strip().title()
-    return scientific_name
+# 支援的日期格式（開頭日期部分的 '/' 與 '.' 分隔符號會先統一為 '-'）
+DATE_FORMATS = ('%Y-%m-%d', '%Y%m%d')
+
+# 月份（1-12）及其標籤
+MONTHS = list(range(1, 13))
+MONTH_LABELS = [str(i) for i in MONTHS]
 
 # 處理日期格式的函數
-def extract_year_month(eventDate):
-    if pd.isna(eventDate):
-        return None, None
-    
-   # 支援的日期格式
-    formats = ['%Y-%m-%d', '%Y/%m/%d', '%Y%m%d', '%Y.%m.%d']
-    
-    for fmt in formats:
-        try:
-            # 嘗試用指定格式解析日期
-            date_obj = datetime.strptime(str(eventDate), fmt)
-            
-            # 返回標準化的日期格式 (%Y-%m-%d)
-            standardized_date = date_obj.strftime('%Y-%m-%d')
-            return date_obj.year, date_obj.month    
-        except ValueError:
-            continue
-    
-    # 如果所有格式都無法匹配，返回 None
-    return None, None
+def parse_event_dates(event_dates):
+    event_dates = event_dates.astype(str)
+
+    # 先整欄一次解析，無法解析的再依序嘗試支援的格式
+    parsed = pd.to_datetime(event_dates, errors='coerce')
+    mask = parsed.isna()
+    if mask.any():
+        # 只改寫開頭的 YYYY.MM.DD / YYYY/MM/DD，避免動到時間部分（如小數秒）
+        event_dates = event_dates.str.replace(
+            r'^(\d{4})[./](\d{1,2})[./](\d{1,2})', r'\1-\2-\3', regex=True
+        )
+    for fmt in DATE_FORMATS:
+        if not mask.any():
+            break
+        retry = pd.to_datetime(event_dates[mask], format=fmt, errors='coerce')
+        parsed = parsed.where(~mask, retry)
+        mask = parsed.isna()
+
+    # 如果所有格式都無法匹配，保留為 NaT
+    return parsed
+
+# 讀取並整理上傳檔案的函數（以檔案內容作為快取鍵值，重新執行時不必再解析）
+@st.cache_data(show_spinner=False)
+def load_data(file_bytes):
+    # 讀取 CSV 檔案內容
+    df = pd.read_csv(io.BytesIO(file_bytes))
+
+    # 格式化學名（空欄位讀入時已是缺值，去除空白後的空字串也視為缺值）
+    names = df['scientificName'].str.strip().str.title()
+
+    # 移除ScientificName=None的rows，並一併寫回學名（以 category 儲存，分組時使用整數代碼）及年份
+    mask = names.notna() & names.ne('')
+    df = df.loc[mask].assign(
+        scientificName=names[mask].astype('category'),
+        year=lambda d: d['year'].astype('Int64').astype('string')
+    )
+    return df
+
+# 依學名、月份及年份加總 individualCount 的函數
+def build_monthly_pivot(df):
+    # 樞紐表（所有物種一次計算）
+    pivot_all = pd.pivot_table(
+        df,
+        index=['scientificName', 'month'],
+        columns='year',
+        values='individualCount',
+        aggfunc='sum',
+        fill_value=0,
+        observed=True
+    )
+
+    # 去除年份的小數點，確保年份為整數
+    pivot_all.columns = [int(col) for col in pivot_all.columns]
+    return pivot_all
+
+# 同一個上傳檔案只計算一次的函數（以 file_id 為鍵值存放在 session_state，重新執行時直接取出）
+def compute_once(name, file_id, compute):
+    if st.session_state.get(f'{name}_key') != file_id:
+        st.session_state[name] = compute()
+        st.session_state[f'{name}_key'] = file_id
+    return st.session_state[name]
 
 # 上傳檔案元件
 uploaded_file = st.file_uploader("請上傳 CSV 檔案", type="csv")
@@ -42,18 +86,8 @@ uploaded_file = st.file_uploader("請上傳 CSV 檔案", type="csv")
 error = False
 
 if uploaded_file is not None:
-    # 讀取 CSV 檔案內容
-    df = pd.read_csv(uploaded_file)
-    
-    # 格式化學名
-    df['scientificName'] = df['scientificName'].apply(standardize_species)
-
-    # empty轉換為空字串
-    df.replace("", np.nan, inplace=True)
-
-    # 移除ScientificName=None的rows
-    df = df[df['scientificName'].notnull()]
-    df['year'] = df['year'].apply(lambda x: str(int(x)) if pd.notna(x) else x)
+    # 同一個上傳檔案只整理一次；以下會直接修改 df，保留 session_state 中的原始資料
+    df = compute_once('df', uploaded_file.file_id, lambda: load_data(uploaded_file.getvalue())).copy()
     st.write(df)
 
     # 處理沒有eventDate的資料
@@ -82,12 +116,12 @@ if uploaded_file is not None:
     #     st.success("所有日期均已正確解析！")
 
     if not error:
-        # 處理日期
-        # df['year'], df['month'] = zip(*df['eventDate'].apply(extract_year_month))
-        
-        # 確保日期欄位為字串並取出年份
-        df['eventDate'] = pd.to_datetime(df['eventDate'], errors='coerce')
-        df['year'] = df['eventDate'].dt.year
+        # 處理日期並取出年份、月份（同一個上傳檔案只解析一次）
+        df['eventDate'] = compute_once(
+            'event_dates', uploaded_file.file_id, lambda: parse_event_dates(df['eventDate'])
+        )
+        df['year'], df['month'] = df['eventDate'].dt.year, df['eventDate'].dt.month
+        df[['year', 'month']] = df[['year', 'month']].astype('Int64')
 
         # 計算每個年份的出現次數
         yearly_counts = df['year'].value_counts().sort_index()
@@ -131,16 +165,85 @@ if uploaded_file is not None:
         st.write("數據表:")
         st.dataframe(yearly_counts)
 
+        # 根據 scientificName 分組並繪製圖表
+        if 'individualCount' in df.columns:
+            # 確保 individualCount 是數字，並填補缺失值
+            counts = pd.to_numeric(df['individualCount'], errors='coerce').fillna(0)
+
+            # 超出 int32 範圍（含無限大）的數量無法繪製圖表
+            int32_range = np.iinfo(np.int32)
+            if not counts.between(int32_range.min, int32_range.max).all():
+                st.warning("individualCount 有超出範圍的數值，無法繪製物種圖表，請檢查資料是否正確!")
+            else:
+                # 數量皆為整數時以 int32 儲存，縮小樞紐表及圖表資料；有小數則保留原值
+                df['individualCount'] = counts.astype('int32') if counts.eq(counts.round()).all() else counts
+
+                # 一次算出所有物種的樞紐表（同一個上傳檔案只計算一次），迴圈中只取出各物種的部分
+                pivot_all = compute_once('pivot_all', uploaded_file.file_id, lambda: build_monthly_pivot(df))
+
+                species_figs = []
+                for name in pivot_all.index.unique(level='scientificName'):
+                    # 補充缺失月份，確保月份完整 (1-12 月份)
+                    pivot_table = pivot_all.loc[name].reindex(MONTHS, fill_value=0)
+                    # 只保留該物種有紀錄的年份
+                    pivot_table = pivot_table.loc[:, pivot_table.ne(0).any()]
+
+                    # 繪製長條圖（只傳入各年份每月的加總值，圖例直接使用整數年份）
+                    fig = go.Figure()
+                    for year in pivot_table.columns:
+                        fig.add_bar(x=MONTHS, y=pivot_table[year].to_numpy(), name=str(year))
+                    # 設定標題、堆疊方式及 x 和 y 軸刻度格式
+                    fig.update_layout(
+                        title=f"{name} 出現次數圖",
+                        barmode="stack",
+                        legend_title_text="年份",
+                        xaxis=dict(title="月份", tickformat=".0f"),
+                        yaxis=dict(tickformat=".0f")
+                    )
+
+                    max_y = int(pivot_table.to_numpy().sum(axis=1).max())  # 找出堆疊後的最大值
+
+                    # 設定 dtick 為 1、5 或 10 中的一個合適數值
+                    if max_y > 50:
+                        dtick = 10
+                    elif max_y > 15:
+                        dtick = 5
+                    else:
+                        dtick = 1
+
+                    # 避免月份重複，固定月份順序
+                    fig.update_layout(
+                        xaxis=dict(
+                            fixedrange=True,  # 禁止縮放 X 軸範圍
+                            tickmode='array',
+                            tickvals=MONTHS,  # 固定 x 軸的刻度值
+                            ticktext=MONTH_LABELS,  # 以 1-12 作為月份標籤
+                            range=[0.5, 12.5],  # 固定 X 軸範圍為 1 到 12
+                            dtick=1,
+                        ),
+                        yaxis=dict(
+                            title="出現次數",
+                            dtick=dtick,  # 設定刻度間隔為 1，避免重複
+                            range=[0, max_y + (dtick - (max_y % dtick))],  # 動態範圍
+                        ),
+                        bargap=0.2,  # 控制條形之間的間距
+                        width=800,  # 圖表寬度
+                        height=600  # 圖表高度
+                    )
+
+                    species_figs.append((name, fig))
+
+                # 以分頁一次顯示所有物種的圖表
+                if species_figs:
+                    tabs = st.tabs([str(name) for name, _ in species_figs])
+                    for tab, (_, fig) in zip(tabs, species_figs):
+                        with tab:
+                            st.plotly_chart(fig)
+
 
-    # 確保 individualCount 是數字，並填補缺失值
-    # df['individualCount'] = pd.to_numeric(df['individualCount'], errors='coerce').fillna(0)
-    
     # 檢查是否有無效值
     # invalid_dates = df[df['year'].isna()]
 
-    # 確保 year 和 month 欄位以整數表示（處理無效值）
-    # df['year'] = df['year'].apply(lambda x: int(x) if pd.notna(x) else None)
-    # df['month'] = df['month'].apply(lambda x: int(x) if pd.notna(x) else None)
 
 
    
@@ -164,91 +267,6 @@ if uploaded_file is not None:
     # st.subheader("更新後的資料：")
     # st.dataframe(df)
 
-    # 根據 scientificName 分組並繪製圖表
-    #grouped = df.groupby("scientificName")
-    
-#     for name, group in df:
-#         if not group.empty:
-#              # 補充缺失月份（1-12）
-#             all_months = pd.DataFrame({'year': range(1, 13)})
-#             group = pd.merge(all_months, group, on='month', how='left').fillna(0)
-            
-#             # 樞紐表
-#             pivot_table = group.pivot_table(
-#                 index='month', 
-#                 columns='year', 
-#                 values='individualCount', 
-#                 aggfunc='sum', 
-#                 fill_value=0
-#             )
-#             st.write("檢查樞紐表：", pivot_table)
-
-#             # 過濾掉年份為 0 的數據
-#             pivot_table = pivot_table.drop(columns=[0], errors='ignore')  # 移除包含年份 0 的列
-
-#             # 去除年份的小數點，確保年份為整數
-#             pivot_table.columns = [int(col) for col in pivot_table.columns]
-
-#             # 繪製長條圖
-#             fig = px.bar(
-#                 pivot_table,
-#                 title=f"{name} 出現次數圖",
-#                 labels={
-#                     "value": "出現次數",
-#                     "month": "月份",
-#                     "variable": "年份"
-#                 },
-#                 barmode="stack"
-#             )
-#             # 設定 x 和 y 軸刻度格式
-#             fig.update_layout(
-#                 xaxis=dict(tickformat=".0f"),
-#                 yaxis=dict(tickformat=".0f")
-#             )
-#             # 確保月份完整 (1-12 月份)
-#             pivot_table = pivot_table.reindex(range(1, 13), fill_value=0)
-            
-#             print(group['individualCount'])  # 檢查 individualCount 內容
-#             max_y = max(group['individualCount'])  # 找出最大值
-
-#             # 設定 dtick 為 1、5 或 10 中的一個合適數值
-#             if max_y > 50:
-#                 dtick = 10
-#             elif max_y > 15:
-#                 dtick = 5
-#             else:
-#                 dtick = 1
-
-
-#             # 避免月份重複，固定月份順序
-#             fig.update_layout(
-#                 xaxis=dict(
-#                     fixedrange=True,  # 禁止縮放 X 軸範圍
-#                     tickmode='array',
-#                     tickvals=list(range(1, 13)),  # 固定 x 軸的刻度值
-#                     ticktext=[str(i) for i in range(1, 13)],  # 以 1-12 作為月份標籤
-#                     range=[0.5, 12.5],  # 固定 X 軸範圍為 1 到 12
-#                     dtick=1,
-#                 ),
-#                 yaxis=dict(
-#                     title="出現次數",
-#                     dtick=dtick,  # 設定刻度間隔為 1，避免重複
-#                     range=[0, max_y + (dtick - (max_y % dtick))],  # 動態範圍
-                    
-#                     #automargin=True,  # 自動調整邊距
-#                     #autorange=True,   # 自動設定範圍
-                   
-#                 ),
-#                 bargap=0.2,  # 控制條形之間的間距
-#                 width=800,  # 圖表寬度
-#                 height=600  # 圖表高度
-                
-#             )
-            
-#             # 更新圖例，移除不必要的項目
-#             fig.for_each_trace(lambda t: t.update(name=str(int(t.name)) if t.name.isdigit() else t.name))
-#             # 顯示圖表
-#             st.plotly_chart(fig)
 # else:
 #     st.info("請上傳檔案以檢視內容。")
 